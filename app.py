@@ -1,6 +1,9 @@
 import io
-from typing import Dict, Any, Tuple
+import re
+from typing import Dict, Any, Optional, Tuple
 
+import altair as alt
+import numpy as np
 import pandas as pd
 import streamlit as st
 
@@ -8,212 +11,445 @@ import streamlit as st
 # -----------------------------
 # Demo dataset: Stationery & Computer Mart UK
 # -----------------------------
+# Stored column-wise (one typed array per column) so the demo frame is built
+# straight from NumPy buffers with no per-row tuples or dtype inference.
+# Each line of the numeric arrays lines up with the same line of _DEMO_CODES.
+_DEMO_CODES = np.array([
+    21, 51, 1100, 1103, 1200, 1210, 1220, 1230, 1240, 2100,
+    2109, 2200, 2201, 2202, 2210, 2211, 2220, 2230, 2300, 2310,
+    4000, 4001, 4002, 4009, 4900, 4905, 5000, 5001, 5002, 5100,
+    6200, 6201, 6202, 6203, 7000, 7006, 7009, 7010, 7011, 7100,
+    7200, 7300, 7301, 7304, 7350, 7400, 7401, 7402, 7403, 7500,
+    7501, 7502, 7802, 7901, 7903, 8003, 8100, 9999,
+], dtype=np.int32)
+
+_DEMO_NAMES = np.array([
+    "Plant/Machinery Depreciation",
+    "Motor Vehicles Depreciation",
+    "Debtors Control Account",
+    "Prepayments",
+    "Bank Current Account",
+    "Bank Deposit Account",
+    "Building Society Account",
+    "Petty Cash",
+    "Company Credit Card",
+    "Creditors Control Account",
+    "Accruals",
+    "Sales Tax Control Account",
+    "Purchase Tax Control Account",
+    "VAT Liability",
+    "P.A.Y.E.",
+    "National Insurance",
+    "Net Wages",
+    "Pension Fund",
+    "Loans",
+    "Hire Purchase",
+    "Sales North",
+    "Sales South",
+    "Sales Scotland",
+    "Discounts Allowed",
+    "Miscellaneous Income",
+    "Distribution and Carriage",
+    "Materials Purchased",
+    "Materials Imported",
+    "Miscellaneous Purchases",
+    "Carriage",
+    "Sales Promotions",
+    "Advertising",
+    "Gifts and Samples",
+    "P.R. (Literature & Brochures)",
+    "Gross Wages",
+    "Employers N.I.",
+    "Adjustments",
+    "SSP Reclaimed",
+    "SMP Reclaimed",
+    "Rent",
+    "Electricity",
+    "Fuel and Oil",
+    "Repairs and Servicing",
+    "Miscellaneous Motor Expenses",
+    "Scale Charges",
+    "Travelling",
+    "Car Hire",
+    "Hotels",
+    "U.K. Entertainment",
+    "Printing",
+    "Postage and Carriage",
+    "Telephone",
+    "Laundry",
+    "Bank Charges",
+    "Loan Interest Paid",
+    "Vehicle Depreciation",
+    "Bad Debt Write Off",
+    "Mispostings Account",
+], dtype=object)
+
+_DEMO_DEBITS = np.array([
+    515.00, 757.44, 89731.16, 1350.00, 3389.99, 2000.00, 505.03, 833.48, 0.00, 0.00,
+    0.00, 0.00, 0.00, 0.00, 0.00, 0.00, 0.00, 0.00, 0.00, 0.00,
+    0.00, 0.00, 0.00, 50.00, 0.00, 870.00, 45446.48, 23733.00, 1158.53, 1.26,
+    50.00, 465.00, 15.00, 1050.00, 24372.11, 2495.43, 170.00, 0.00, 0.00, 15750.00,
+    952.00, 15.00, 88.18, 67.00, 60.18, 201.00, 150.00, 720.00, 5.50, 51.60,
+    3.50, 128.72, 50.00, 5.56, 83.25, 757.44, 0.01, 205.00,
+], dtype=np.float64)
+
+_DEMO_CREDITS = np.array([
+    0.00, 0.00, 0.00, 0.00, 0.00, 0.00, 0.00, 0.00, 10414.97, 36572.97,
+    50.00, 22152.44, 11102.51, 14800.35, 2070.23, 1003.49, 0.00, 80.00, 605.00, 1800.00,
+    179507.53, 1230.00, 8472.51, 0.00, 60.03, 0.00, 0.00, 0.00, 0.00, 0.00,
+    0.00, 0.00, 0.00, 0.00, 0.00, 0.00, 0.00, 30.00, 48.40, 0.00,
+    0.00, 0.00, 0.00, 0.00, 0.00, 0.00, 0.00, 0.00, 0.00, 0.00,
+    0.00, 0.00, 0.00, 0.00, 0.00, 0.00, 0.00, 0.00,
+], dtype=np.float64)
+
+
+@st.cache_data
 def load_demo_trial_balance() -> pd.DataFrame:
     """
     Hard-coded demo TB based on the Sage 50 Stationery & Computer Mart
     transactional trial balance for 01/01/2024–01/12/2024.
 
     Columns:
-        code   : nominal code (int)
-        name   : account name
-        debit  : debit balance in period
-        credit : credit balance in period
+        code    : nominal code (int32)
+        name    : account name
+        balance : debit minus credit balance in period
     """
-    data = [
-        (21,   "Plant/Machinery Depreciation",            515.00,    0.00),
-        (51,   "Motor Vehicles Depreciation",             757.44,    0.00),
-        (1100, "Debtors Control Account",              89731.16,    0.00),
-        (1103, "Prepayments",                            1350.00,    0.00),
-        (1200, "Bank Current Account",                   3389.99,    0.00),
-        (1210, "Bank Deposit Account",                   2000.00,    0.00),
-        (1220, "Building Society Account",                505.03,    0.00),
-        (1230, "Petty Cash",                              833.48,    0.00),
-        (1240, "Company Credit Card",                       0.00, 10414.97),
-        (2100, "Creditors Control Account",                 0.00, 36572.97),
-        (2109, "Accruals",                                  0.00,    50.00),
-        (2200, "Sales Tax Control Account",                 0.00, 22152.44),
-        (2201, "Purchase Tax Control Account",              0.00, 11102.51),
-        (2202, "VAT Liability",                             0.00, 14800.35),
-        (2210, "P.A.Y.E.",                                  0.00,  2070.23),
-        (2211, "National Insurance",                        0.00,  1003.49),
-        (2220, "Net Wages",                                 0.00,     0.00),
-        (2230, "Pension Fund",                              0.00,    80.00),
-        (2300, "Loans",                                     0.00,   605.00),
-        (2310, "Hire Purchase",                             0.00,  1800.00),
-        (4000, "Sales North",                               0.00, 179507.53),
-        (4001, "Sales South",                               0.00,   1230.00),
-        (4002, "Sales Scotland",                            0.00,   8472.51),
-        (4009, "Discounts Allowed",                         50.00,     0.00),
-        (4900, "Miscellaneous Income",                      0.00,    60.03),
-        (4905, "Distribution and Carriage",                870.00,     0.00),
-        (5000, "Materials Purchased",                     45446.48,    0.00),
-        (5001, "Materials Imported",                      23733.00,    0.00),
-        (5002, "Miscellaneous Purchases",                 1158.53,     0.00),
-        (5100, "Carriage",                                   1.26,     0.00),
-        (6200, "Sales Promotions",                          50.00,     0.00),
-        (6201, "Advertising",                              465.00,     0.00),
-        (6202, "Gifts and Samples",                         15.00,     0.00),
-        (6203, "P.R. (Literature & Brochures)",           1050.00,     0.00),
-        (7000, "Gross Wages",                            24372.11,    0.00),
-        (7006, "Employers N.I.",                          2495.43,    0.00),
-        (7009, "Adjustments",                              170.00,    0.00),
-        (7010, "SSP Reclaimed",                              0.00,    30.00),
-        (7011, "SMP Reclaimed",                              0.00,    48.40),
-        (7100, "Rent",                                   15750.00,     0.00),
-        (7200, "Electricity",                               952.00,   0.00),
-        (7300, "Fuel and Oil",                               15.00,   0.00),
-        (7301, "Repairs and Servicing",                      88.18,   0.00),
-        (7304, "Miscellaneous Motor Expenses",               67.00,   0.00),
-        (7350, "Scale Charges",                              60.18,   0.00),
-        (7400, "Travelling",                                201.00,   0.00),
-        (7401, "Car Hire",                                  150.00,   0.00),
-        (7402, "Hotels",                                    720.00,   0.00),
-        (7403, "U.K. Entertainment",                          5.50,   0.00),
-        (7500, "Printing",                                   51.60,   0.00),
-        (7501, "Postage and Carriage",                        3.50,   0.00),
-        (7502, "Telephone",                                 128.72,   0.00),
-        (7802, "Laundry",                                    50.00,   0.00),
-        (7901, "Bank Charges",                                5.56,   0.00),
-        (7903, "Loan Interest Paid",                         83.25,   0.00),
-        (8003, "Vehicle Depreciation",                      757.44,   0.00),
-        (8100, "Bad Debt Write Off",                          0.01,   0.00),
-        (9999, "Mispostings Account",                       205.00,   0.00),
-    ]
-    df = pd.DataFrame(data, columns=["code", "name", "debit", "credit"])
-    df["code"] = df["code"].astype(int)
-    df["balance"] = df["debit"] - df["credit"]
-    return df
+    return pd.DataFrame(
+        {
+            "code": _DEMO_CODES,
+            "name": _DEMO_NAMES,
+            "balance": _DEMO_DEBITS - _DEMO_CREDITS,
+        }
+    )
+
+
+# -----------------------------
+# Chart of accounts mapping
+# -----------------------------
+# Nominal codes per P&L / working capital bucket, based on the default
+# Sage 50 UK chart of accounts. Debtors, prepayments and creditors get their
+# own buckets because the efficiency ratios need them separately; they are
+# added back into current assets / liabilities in calculate_ratios.
+BUCKET_CODES = {
+    "sales": frozenset({4000, 4001, 4002}),
+    "discounts": frozenset({4009}),
+    "misc_income": frozenset({4900}),
+    "cogs": frozenset({5000, 5001, 5002, 5100}),
+    "expenses": frozenset({
+        4905, 6200, 6201, 6202, 6203,
+        7000, 7006, 7009,
+        7100, 7200,
+        7300, 7301, 7304,
+        7350, 7400, 7401, 7402, 7403,
+        7500, 7501, 7502,
+        7802,
+        7901,
+        8003,
+        8100,
+    }),
+    "ssp_smp": frozenset({7010, 7011}),
+    "finance_cost": frozenset({7903}),
+    "debtors": frozenset({1100}),
+    "prepayments": frozenset({1103}),
+    "other_ca": frozenset({1200, 1210, 1220, 1230}),
+    "creditors": frozenset({2100}),
+    "other_cl": frozenset({2109, 2200, 2201, 2202, 2210, 2211, 2220, 2230, 1240}),
+}
+
+CODE_TO_BUCKET = {
+    code: bucket for bucket, codes in BUCKET_CODES.items() for code in codes
+}
+
+# Dense code -> bucket id lookup table (a few KB), so calculate_ratios can
+# label a whole array of codes with one fancy-indexing pass. The final slot
+# is an "unmapped" bucket; codes past the end are clipped onto it (and
+# negative codes onto code 0, which is unmapped too).
+_BUCKET_NAMES = tuple(BUCKET_CODES)
+_UNMAPPED = len(_BUCKET_NAMES)
+_BUCKET_OF_CODE = np.full(max(CODE_TO_BUCKET) + 2, _UNMAPPED, dtype=np.int8)
+for _code, _bucket in CODE_TO_BUCKET.items():
+    _BUCKET_OF_CODE[_code] = _BUCKET_NAMES.index(_bucket)
 
 
 # -----------------------------
 # Utility functions
 # -----------------------------
+# Digits of a nominal code embedded in free text, e.g. "N1100" -> "1100".
+_CODE_RE = re.compile(r"(\d+)")
+
+# Header keywords used to detect each standard column, in priority order.
+TB_COLUMN_KEYWORDS = {
+    "code": ("code", "n/c", "nominal"),
+    "name": ("name",),
+    "debit": ("debit",),
+    "credit": ("credit",),
+}
+
+
 def normalise_tb_columns(df: pd.DataFrame) -> pd.DataFrame:
     """
-    Try to standardise an uploaded Sage TB into columns: code, name, debit, credit.
+    Try to standardise an uploaded Sage TB into columns: code, name, balance.
 
-    Looks for column names containing 'code', 'name', 'debit', 'credit'.
+    Looks for column names containing 'code', 'name', 'debit', 'credit', and
+    nets the debit and credit columns into a single balance.
     """
-    cols_lower = {c.lower(): c for c in df.columns}
-
-    def find_col(keyword: str):
-        for c in df.columns:
-            if keyword in c.lower():
-                return c
-        return None
-
-    code_col = find_col("code") or find_col("n/c") or find_col("nominal")
-    name_col = find_col("name")
-    debit_col = find_col("debit")
-    credit_col = find_col("credit")
+    # Lowercase each header once and score it against every field in the
+    # same pass. Earlier keywords win, so a 'code' column beats an 'n/c' one.
+    # Columns are picked by position: the pyarrow CSV reader keeps duplicate
+    # headers as-is, so selecting by label could return a DataFrame.
+    found: Dict[str, Tuple[int, int]] = {}
+    for pos, col in enumerate(df.columns):
+        low = str(col).lower()
+        for field, keywords in TB_COLUMN_KEYWORDS.items():
+            for rank, keyword in enumerate(keywords):
+                if keyword in low:
+                    if field not in found or rank < found[field][0]:
+                        found[field] = (rank, pos)
+                    break
+
+    code_raw, name_raw, debit_raw, credit_raw = (
+        df.iloc[:, found[field][1]] if field in found else None
+        for field in TB_COLUMN_KEYWORDS
+    )
 
-    missing = [x for x in [code_col, name_col, debit_col, credit_col] if x is None]
+    missing = [field for field in TB_COLUMN_KEYWORDS if field not in found]
     if missing:
         raise ValueError(
             "Could not automatically detect columns for code/name/debit/credit. "
             "Please ensure your export includes those headings."
         )
 
-    out = pd.DataFrame()
-    out["code"] = df[code_col].astype(str).str.extract(r"(\d+)")[0].astype(int)
-    out["name"] = df[name_col].astype(str)
-    out["debit"] = pd.to_numeric(df[debit_col], errors="coerce").fillna(0.0)
-    out["credit"] = pd.to_numeric(df[credit_col], errors="coerce").fillna(0.0)
-    out["balance"] = out["debit"] - out["credit"]
-    return out
+    # Common case: codes are whole numbers, so no regex is needed. Otherwise
+    # pull the digits out of values like "N1100", "1100 Sales" or "4000.7".
+    # Go via NumPy float64 so unparseable values show up as NaN whatever the
+    # backend (Arrow-backed columns would otherwise report NaN, not NA).
+    numeric = pd.to_numeric(code_raw, errors="coerce").to_numpy(
+        dtype=np.float64, na_value=np.nan
+    )
+    if np.isnan(numeric).any() or (numeric % 1 != 0).any():
+        codes = code_raw.astype(str).str.extract(_CODE_RE, expand=False).astype("Int64")
+    else:
+        codes = pd.Series(numeric, index=code_raw.index).astype("Int64")
+
+    # Cast to NumPy float64 first, then fill: Arrow-backed columns keep
+    # unparseable cells as NaN rather than NA, which fillna would skip. The
+    # cast also makes balance one contiguous subtraction matching the demo
+    # TB dtypes.
+    debit = pd.to_numeric(debit_raw, errors="coerce").astype(np.float64).fillna(0.0)
+    credit = pd.to_numeric(credit_raw, errors="coerce").astype(np.float64).fillna(0.0)
+
+    out = pd.DataFrame(
+        {
+            "code": codes,
+            "name": name_raw.astype(str),
+            "balance": debit - credit,
+        }
+    )
+    # Rows with no nominal code at all (blank lines, "Totals" rows) can't be
+    # mapped to a category, so drop them rather than failing the whole file.
+    # Codes stay int64: narrowing to int32 would wrap oversized codes onto
+    # real ones, whereas calculate_ratios clips them into the unmapped bucket.
+    return out[codes.notna()].astype({"code": np.int64})
+
 
+@st.cache_data
+def read_trial_balance(data: bytes, filename: str) -> pd.DataFrame:
+    """
+    Parse and standardise an uploaded TB file.
 
-def calculate_ratios(df: pd.DataFrame) -> Tuple[Dict[str, Any], pd.DataFrame]:
+    Keyed on the raw file bytes so Streamlit reruns with the same upload
+    skip the read and normalise steps entirely.
+    """
+    name = filename.lower()
+    if name.endswith(".csv"):
+        try:
+            raw = pd.read_csv(io.BytesIO(data), engine="pyarrow", dtype_backend="pyarrow")
+        except pd.errors.ParserError:
+            # The pyarrow engine rejects ragged rows (e.g. trailing empty
+            # fields dropped by spreadsheet exports); the C engine pads them.
+            raw = pd.read_csv(io.BytesIO(data))
+    elif name.endswith(".parquet"):
+        raw = pd.read_parquet(io.BytesIO(data), engine="pyarrow")
+    else:
+        raw = pd.read_excel(io.BytesIO(data))
+
+    return normalise_tb_columns(raw)
+
+
+# KPI tiles by section, one tuple per row of columns. Each tile is
+# (label, value format, delta label or None, delta format or None).
+# calculate_ratios pre-formats every tile listed here.
+KPI_SECTIONS = (
+    (
+        "Key profitability ratios",
+        (
+            (
+                ("Net sales (£)", "{:,.2f}", None, None),
+                ("Gross profit (£)", "{:,.2f}", "Gross margin (%)", "{:.2f}% GP margin"),
+                ("Operating profit (£)", "{:,.2f}", "Operating margin (%)", "{:.2f}% OP margin"),
+            ),
+            (
+                ("Profit before tax (£)", "{:,.2f}", "Net margin (PBT, %)", "{:.2f}% net margin"),
+                ("Finance cost (£)", "{:,.2f}", None, None),
+            ),
+        ),
+    ),
+    (
+        "Liquidity & working capital",
+        (
+            (
+                ("Current ratio", "{:.2f}", None, None),
+                ("Quick ratio", "{:.2f}", None, None),
+                ("Working capital (£)", "{:,.2f}", None, None),
+            ),
+            (
+                ("Receivables days", "{:.1f} days", None, None),
+                ("Payables days", "{:.1f} days", None, None),
+            ),
+        ),
+    ),
+)
+
+
+# Keys of the ratios dict returned by calculate_ratios, in display order.
+RATIO_LABELS = (
+    "Net sales (£)",
+    "Gross profit (£)",
+    "Gross margin (%)",
+    "Operating profit (£)",
+    "Operating margin (%)",
+    "Profit before tax (£)",
+    "Net margin (PBT, %)",
+    "Current assets (£)",
+    "Current liabilities (£)",
+    "Working capital (£)",
+    "Current ratio",
+    "Quick ratio",
+    "Receivables days",
+    "Payables days",
+)
+
+
+@st.cache_data
+def calculate_ratios(
+    df: pd.DataFrame,
+) -> Tuple[Dict[str, Any], pd.Series, Dict[str, Tuple[str, Optional[str]]]]:
     """
     Calculate a set of ratios from a standardised trial balance DataFrame.
 
     The logic is tailored to the Sage 50 demo chart of accounts but is easy
     to adapt to other nominal code structures.
+
+    Returns the ratios, the P&L breakdown for the chart, and the display
+    strings (value, delta) for each KPI tile in KPI_SECTIONS.
     """
-    def bal(code: int) -> float:
-        row = df[df["code"] == code]
-        return (row["balance"]).sum()
+    # One linear sweep over the raw arrays: look up each row's bucket id, then
+    # sum balances per bucket. Unmapped codes land in the trailing slot, which
+    # is dropped.
+    codes = df["code"].to_numpy()
+    balance = df["balance"].to_numpy(dtype=np.float64)
+
+    bucket_ids = _BUCKET_OF_CODE[np.clip(codes, 0, _BUCKET_OF_CODE.size - 1)]
+    totals = np.bincount(bucket_ids, weights=balance, minlength=_UNMAPPED + 1)
+    sums = dict(zip(_BUCKET_NAMES, totals[:_UNMAPPED]))
 
     # --- Revenue & cost of sales ---
-    sales_codes = [4000, 4001, 4002]
-    sales = -df[df["code"].isin(sales_codes)]["balance"].sum()  # credits -> positive
-    discounts = df[df["code"] == 4009]["balance"].sum()
+    sales = -sums["sales"]  # credits -> positive
+    discounts = sums["discounts"]
     net_sales = sales - discounts
 
-    cogs_codes = [5000, 5001, 5002, 5100]
-    cogs = df[df["code"].isin(cogs_codes)]["balance"].sum()
+    cogs = sums["cogs"]
 
     gross_profit = net_sales - cogs
-    gross_margin_pct = (gross_profit / net_sales * 100) if net_sales else None
 
     # --- Operating expenses ---
-    expense_codes = [
-        4905, 6200, 6201, 6202, 6203,
-        7000, 7006, 7009,
-        7100, 7200,
-        7300, 7301, 7304,
-        7350, 7400, 7401, 7402, 7403,
-        7500, 7501, 7502,
-        7802,
-        7901,
-        8003,
-        8100,
-    ]
-    expenses = df[df["code"].isin(expense_codes)]["balance"].sum()
+    expenses = sums["expenses"]
     # SSP/SMP reclaimed – treated as reductions in wages
-    ssp_smp_recovery = -df[df["code"].isin([7010, 7011])]["balance"].sum()
+    ssp_smp_recovery = -sums["ssp_smp"]
     operating_expenses = expenses - ssp_smp_recovery
 
-    misc_income = -bal(4900)  # credit balance -> positive income
+    misc_income = -sums["misc_income"]  # credit balance -> positive income
 
     operating_profit = gross_profit - operating_expenses + misc_income
-    operating_margin_pct = (operating_profit / net_sales * 100) if net_sales else None
 
     # --- Finance cost & profit before tax ---
-    finance_cost = df[df["code"] == 7903]["balance"].sum()
+    finance_cost = sums["finance_cost"]
     profit_before_tax = operating_profit - finance_cost
-    net_margin_pct = (profit_before_tax / net_sales * 100) if net_sales else None
 
     # --- Working capital & liquidity ---
-    current_asset_codes = [1100, 1103, 1200, 1210, 1220, 1230]
-    current_liability_codes = [2100, 2109, 2200, 2201, 2202, 2210, 2211, 2220, 2230, 1240]
+    debtors = sums["debtors"]
+    prepayments = sums["prepayments"]
+    creditors = -sums["creditors"]  # credit balance
 
-    current_assets = df[df["code"].isin(current_asset_codes)]["balance"].sum()
+    current_assets = debtors + prepayments + sums["other_ca"]
     # liabilities are credit balances (negative), so flip sign
-    current_liabilities = -df[df["code"].isin(current_liability_codes)]["balance"].sum()
+    current_liabilities = creditors - sums["other_cl"]
     working_capital = current_assets - current_liabilities
-
-    current_ratio = (current_assets / current_liabilities) if current_liabilities else None
-    quick_assets = current_assets - df[df["code"] == 1103]["balance"].sum()  # exclude prepayments
-    quick_ratio = (quick_assets / current_liabilities) if current_liabilities else None
-
-    # --- Efficiency ratios ---
-    debtors = bal(1100)
-    creditors = -bal(2100)  # credit balance
-    receivables_days = (debtors / net_sales * 365) if net_sales else None
-    payables_days = (creditors / cogs * 365) if cogs else None
-
-    ratios = {
-        "Net sales (£)": net_sales,
-        "Gross profit (£)": gross_profit,
-        "Gross margin (%)": gross_margin_pct,
-        "Operating profit (£)": operating_profit,
-        "Operating margin (%)": operating_margin_pct,
-        "Profit before tax (£)": profit_before_tax,
-        "Net margin (PBT, %)": net_margin_pct,
-        "Current assets (£)": current_assets,
-        "Current liabilities (£)": current_liabilities,
-        "Working capital (£)": working_capital,
-        "Current ratio": current_ratio,
-        "Quick ratio": quick_ratio,
-        "Receivables days": receivables_days,
-        "Payables days": payables_days,
-    }
-
-    # Build a small breakdown table for the dashboard chart
-    breakdown = pd.DataFrame(
-        {
-            "Category": [
+    quick_assets = current_assets - prepayments  # exclude prepayments
+
+    # --- Margin, liquidity & efficiency ratios ---
+    # Divide all numerator/denominator pairs in one go; a zero denominator
+    # leaves NaN in that slot instead of raising.
+    num = np.array([
+        gross_profit * 100,
+        operating_profit * 100,
+        profit_before_tax * 100,
+        current_assets,
+        quick_assets,
+        debtors * 365,
+        creditors * 365,
+    ], dtype=np.float64)
+    den = np.array([
+        net_sales,
+        net_sales,
+        net_sales,
+        current_liabilities,
+        current_liabilities,
+        net_sales,
+        cogs,
+    ], dtype=np.float64)
+    (
+        gross_margin_pct,
+        operating_margin_pct,
+        net_margin_pct,
+        current_ratio,
+        quick_ratio,
+        receivables_days,
+        payables_days,
+    ) = np.divide(num, den, out=np.full_like(num, np.nan), where=den != 0)
+
+    # Same order as RATIO_LABELS
+    values = (
+        net_sales,
+        gross_profit,
+        gross_margin_pct,
+        operating_profit,
+        operating_margin_pct,
+        profit_before_tax,
+        net_margin_pct,
+        current_assets,
+        current_liabilities,
+        working_capital,
+        current_ratio,
+        quick_ratio,
+        receivables_days,
+        payables_days,
+    )
+    ratios = dict(zip(RATIO_LABELS, values))
+
+    # Build a small breakdown series (indexed by category) for the dashboard chart
+    breakdown = pd.Series(
+        [
+            net_sales,
+            -cogs,  # show as negative bar
+            gross_profit,
+            -operating_expenses,
+            operating_profit,
+            -finance_cost,
+            profit_before_tax,
+        ],
+        index=pd.Index(
+            [
                 "Net sales",
                 "Cost of sales",
                 "Gross profit",
@@ -222,29 +458,74 @@ def calculate_ratios(df: pd.DataFrame) -> Tuple[Dict[str, Any], pd.DataFrame]:
                 "Finance cost",
                 "Profit before tax",
             ],
-            "Amount": [
-                net_sales,
-                -cogs,  # show as negative bar
-                gross_profit,
-                -operating_expenses,
-                operating_profit,
-                -finance_cost,
-                profit_before_tax,
-            ],
-        }
+            name="Category",
+        ),
+        name="Amount",
+    )
+
+    # Pre-format every KPI tile so reruns that hit the cache skip formatting too
+    tile_values = {**ratios, "Finance cost (£)": finance_cost}
+    formatted = {
+        label: (
+            value_fmt.format(tile_values[label]),
+            delta_fmt.format(tile_values[delta_key]) if delta_key else None,
+        )
+        for _, rows in KPI_SECTIONS
+        for row in rows
+        for label, value_fmt, delta_key, delta_fmt in row
+    }
+
+    return ratios, breakdown, formatted
+
+
+def build_breakdown_chart(breakdown: pd.Series) -> alt.Chart:
+    """
+    Bar chart of the P&L breakdown, with categories kept in P&L order
+    rather than sorted alphabetically.
+    """
+    return (
+        alt.Chart(breakdown.reset_index())
+        .mark_bar()
+        .encode(
+            x=alt.X("Category:N", sort=list(breakdown.index)),
+            y=alt.Y("Amount:Q"),
+        )
     )
 
-    return ratios, breakdown
+
+@st.cache_resource
+def load_demo_ratios() -> Tuple[
+    Dict[str, Any], pd.Series, Dict[str, Tuple[str, Optional[str]]]
+]:
+    """
+    Ratios for the constant demo TB, evaluated once per server process.
+
+    cache_resource hands back the same objects on every rerun, skipping the
+    argument hashing and unpickling that calculate_ratios' cache_data needs.
+    Callers must not mutate the result.
+    """
+    return calculate_ratios(load_demo_trial_balance())
+
+
+@st.cache_resource
+def load_demo_chart() -> alt.Chart:
+    """
+    P&L chart spec for the demo TB, built once per server process.
+    """
+    return build_breakdown_chart(load_demo_ratios()[1])
 
 
 # -----------------------------
 # Streamlit UI
 # -----------------------------
 def main():
-    st.set_page_config(
-        page_title="Trial Balance Ratio Dashboard",
-        layout="wide",
-    )
+    # main() re-runs on every interaction; configure the page once per session
+    if "_configured" not in st.session_state:
+        st.set_page_config(
+            page_title="Trial Balance Ratio Dashboard",
+            layout="wide",
+        )
+        st.session_state._configured = True
 
     st.title("Accounting Ratio Dashboard")
     st.caption("Sage 50 transactional trial balance → Key ratios & visuals")
@@ -255,7 +536,7 @@ def main():
         "Use demo Stationery & Computer Mart TB",
         value=True,
         help="If ticked, uses the built-in Sage 50 demo data. "
-             "Untick to upload your own trial balance (CSV/Excel).",
+             "Untick to upload your own trial balance (CSV/Excel/Parquet).",
     )
 
     uploaded_file = None
@@ -263,22 +544,25 @@ def main():
 
     if not use_demo:
         uploaded_file = st.sidebar.file_uploader(
-            "Upload trial balance (CSV or Excel)",
-            type=["csv", "xlsx", "xls"],
+            "Upload trial balance (CSV, Excel or Parquet)",
+            type=["csv", "xlsx", "xls", "parquet"],
             help="Export the transactional trial balance from Sage and upload it here.",
         )
 
+    # Reuse the TB resolved on a previous rerun if the data source is unchanged
+    # (file_id changes on every upload, even of a same-named, same-size file)
+    source = (use_demo, uploaded_file.file_id if uploaded_file is not None else None)
+    reuse = st.session_state.get("tb_source") == source
+
     if use_demo:
-        df_tb = load_demo_trial_balance()
+        df_tb = st.session_state["df_tb"] if reuse else load_demo_trial_balance()
         st.sidebar.success("Using built-in Sage 50 demo trial balance.")
     elif uploaded_file is not None:
         try:
-            if uploaded_file.name.lower().endswith(".csv"):
-                raw = pd.read_csv(uploaded_file)
+            if reuse:
+                df_tb = st.session_state["df_tb"]
             else:
-                raw = pd.read_excel(uploaded_file)
-
-            df_tb = normalise_tb_columns(raw)
+                df_tb = read_trial_balance(uploaded_file.getvalue(), uploaded_file.name)
             st.sidebar.success("File uploaded and parsed successfully.")
         except Exception as e:
             st.sidebar.error(f"Error reading file: {e}")
@@ -287,47 +571,42 @@ def main():
         st.info("Upload a trial balance file or enable the demo data to view ratios.")
         return
 
+    st.session_state["tb_source"] = source
+    st.session_state["df_tb"] = df_tb
+
     # Show raw TB in an expander
+    # Only balance is stored; debit/credit are rebuilt here just for display
     with st.expander("View trial balance data"):
-        st.dataframe(df_tb, use_container_width=True)
+        st.dataframe(
+            df_tb.assign(
+                debit=df_tb["balance"].clip(lower=0.0),
+                credit=(-df_tb["balance"]).clip(lower=0.0),
+            ),
+            use_container_width=True,
+        )
 
     # Calculate ratios
-    ratios, breakdown = calculate_ratios(df_tb)
+    if use_demo:
+        ratios, breakdown, formatted = load_demo_ratios()
+    else:
+        ratios, breakdown, formatted = calculate_ratios(df_tb)
 
     # -----------------------------
     # KPI tiles
     # -----------------------------
-    st.subheader("Key profitability ratios")
-
-    col1, col2, col3 = st.columns(3)
-    col1.metric("Net sales (£)", f"{ratios['Net sales (£)']:,.2f}")
-    col2.metric("Gross profit (£)", f"{ratios['Gross profit (£)']:,.2f}",
-                f"{ratios['Gross margin (%)']:.2f}% GP margin")
-    col3.metric("Operating profit (£)", f"{ratios['Operating profit (£)']:,.2f}",
-                f"{ratios['Operating margin (%)']:.2f}% OP margin")
-
-    col4, col5 = st.columns(2)
-    col4.metric("Profit before tax (£)", f"{ratios['Profit before tax (£)']:,.2f}",
-                f"{ratios['Net margin (PBT, %)']:.2f}% net margin")
-    col5.metric("Finance cost (£)", f"{-breakdown.loc[breakdown['Category']=='Finance cost','Amount'].iloc[0]:,.2f}")
-
-    st.subheader("Liquidity & working capital")
-
-    col6, col7, col8 = st.columns(3)
-    col6.metric("Current ratio", f"{ratios['Current ratio']:.2f}")
-    col7.metric("Quick ratio", f"{ratios['Quick ratio']:.2f}")
-    col8.metric("Working capital (£)", f"{ratios['Working capital (£)']:,.2f}")
-
-    col9, col10 = st.columns(2)
-    col9.metric("Receivables days", f"{ratios['Receivables days']:.1f} days")
-    col10.metric("Payables days", f"{ratios['Payables days']:.1f} days")
+    for heading, rows in KPI_SECTIONS:
+        st.subheader(heading)
+        for row in rows:
+            for col, (label, *_) in zip(st.columns(len(row)), row):
+                value, delta = formatted[label]
+                col.metric(label, value, delta)
 
     # -----------------------------
     # Visuals
     # -----------------------------
     st.subheader("P&L structure")
-    st.bar_chart(
-        breakdown.set_index("Category")["Amount"],
+    st.altair_chart(
+        load_demo_chart() if use_demo else build_breakdown_chart(breakdown),
         use_container_width=True,
     )
 